@@ -1,15 +1,14 @@
 import logging
 import re
-import requests
 import uuid
-import json
-import tempfile
 import waiting
 from pathlib import Path
-from typing import List
 
 from collections import OrderedDict
 from dataclasses import dataclass
+from functools import cached_property
+from bmhstatuswriter import BMHStatusWriter
+from isodownloader import IsoDownloader
 from statemachine import RetryingStateMachine
 from swarmexecutor import SwarmExecutor
 from swarmkubecache import SwarmKubeCache
@@ -20,6 +19,15 @@ from assisted_swarm_client.assisted_swarm import SwarmApi, AgentStatus
 
 SCRIPT_DIR = Path(__file__).parent
 
+# How long to wait for the kube cache to see an object / ISO URL before giving up and letting the state machine retry
+ISO_URL_WAIT_TIMEOUT_SECONDS = 60
+BMH_WAIT_TIMEOUT_SECONDS = 60
+
+# How long to wait for the swarm's BMH status writer before giving up and letting the state machine retry
+BMH_STATUS_WRITE_TIMEOUT_SECONDS = 60
+
+UUID_REGEX = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
 
 @dataclass
 class SwarmAgentConfig:
@@ -45,6 +53,8 @@ class SwarmAgentConfig:
     kube_cache: SwarmKubeCache
     num_locks: int
     swarm_client: SwarmApi
+    bmh_status_writer: BMHStatusWriter
+    iso_downloader: IsoDownloader
 
 
 @dataclass
@@ -62,7 +72,7 @@ class ClusterAgentConfig:
     machine_ip: str
     cluster_identifier: str
     cluster_dir: Path
-    cluster_hosts: List[dict]
+    cluster_hosts_file_path: str
     agent_dir: Path
     fake_reboot_marker_path: Path
 
@@ -100,6 +110,8 @@ class Agent(RetryingStateMachine, WithContainerConfigs):
         self.swarm_agent_config = swarm_agent_config
         self.cluster_agent_config = cluster_agent_config
 
+        # This becomes the host's ID in the service - the swarm API requires it to be a UUID (see
+        # dry_forced_host_id in swagger.yaml), so it can't be replaced by a cheaper non-UUID identifier
         self.host_id = str(uuid.uuid4())
         self.identifier = cluster_agent_config.identifier
         self.logging = logging
@@ -120,113 +132,122 @@ class Agent(RetryingStateMachine, WithContainerConfigs):
 
         # Endpoints
         self.service_url = swarm_agent_config.service_url
-        self.k8s_api_server_url = swarm_agent_config.k8s_api_server_url
 
         # Logging paths
-        self.log_dir = self.agent_dir / "logs"
         self.agent_stdout_path = self.agent_dir / "agent.stdout.logs"
         self.agent_stderr_path = self.agent_dir / "agent.stderr.logs"
+        self.last_wait_log = None
+
+    def log_wait(self, message, *args):
+        # Waiting states may be retried many times in a row, only log when what we're waiting for changes.
+        # The same message in a different state is a new wait, so it's logged again
+        wait_log = (self.state, message, args)
+        if wait_log != self.last_wait_log:
+            self.logging.info(message, *args)
+            self.last_wait_log = wait_log
 
     def initialize(self, next_state):
-        for dir in (self.agent_dir, self.log_dir, self.personal_graphroot):
-            dir.mkdir(parents=True, exist_ok=True)
+        # The cluster directory is created by the cluster and podman creates the graphroot on its own
+        # (just like it does for the cluster's), so the agent directory is all that's left to create
+        self.agent_dir.mkdir(exist_ok=True)
 
         return next_state
 
     def download_iso(self, next_state):
-        self.swarm_agent_config.executor.check_call(
-            ["curl", "--insecure", "--silent", "--show-error", "--output", "/dev/null", self.bmh_iso_url]
-        )
+        self.swarm_agent_config.iso_downloader.ensure(self.infraenv_id, self.bmh_iso_url)
 
         return next_state
 
     @staticmethod
     def get_infraenv_id_from_url(url):
-        uuid_regex = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
-
-        search = re.search(uuid_regex, url)
+        search = UUID_REGEX.search(url)
         if search:
             return search.group(0)
 
         raise RuntimeError("Could not find infraenv ID from url")
 
     def wait_iso_url_infraenv(self, next_state):
-        infraenv = self.swarm_agent_config.kube_cache.get_infraenv(
-            namespace=self.cluster_agent_config.cluster_identifier, name=self.cluster_agent_config.cluster_identifier
+        iso_url = self.swarm_agent_config.kube_cache.wait_for_field(
+            "infraenvs",
+            namespace=self.cluster_agent_config.cluster_identifier,
+            name=self.cluster_agent_config.cluster_identifier,
+            path=("status", "isoDownloadURL"),
+            timeout=ISO_URL_WAIT_TIMEOUT_SECONDS,
         )
 
-        if infraenv is not None:
-            iso_url = infraenv.get("status", {}).get("isoDownloadURL", "")
-
-            if iso_url == "":
-                self.logging.info("Infraenv .status.isoDownloadURL is empty")
-                return self.state
+        if not iso_url:
+            infraenv = self.swarm_agent_config.kube_cache.get_infraenv(
+                namespace=self.cluster_agent_config.cluster_identifier,
+                name=self.cluster_agent_config.cluster_identifier,
+            )
 
-            self.logging.info(f"Infraenv .status.isoDownloadURL found {iso_url}")
-            self.infraenv_iso_url = iso_url
+            if infraenv is None:
+                self.log_wait(
+                    "Infraenv %s/%s not found",
+                    self.cluster_agent_config.cluster_identifier,
+                    self.cluster_agent_config.cluster_identifier,
+                )
+            else:
+                self.log_wait("Infraenv .status.isoDownloadURL is empty")
 
-            self.infraenv_id = self.get_infraenv_id_from_url(self.infraenv_iso_url)
+            return self.state
 
-            return next_state
+        self.logging.info("Infraenv .status.isoDownloadURL found %s", iso_url)
+        self.infraenv_iso_url = iso_url
 
-        self.logging.info(
-            f"Infraenv {self.cluster_agent_config.cluster_identifier}/{self.cluster_agent_config.cluster_identifier} not found"
-        )
+        self.infraenv_id = self.get_infraenv_id_from_url(self.infraenv_iso_url)
 
-        return self.state
+        return next_state
 
     def wait_iso_url_bmh(self, next_state):
-        baremetalhost = self.swarm_agent_config.kube_cache.get_baremetalhost(
-            namespace=self.cluster_agent_config.cluster_identifier, name=self.identifier
+        iso_url = self.swarm_agent_config.kube_cache.wait_for_field(
+            "baremetalhosts",
+            namespace=self.cluster_agent_config.cluster_identifier,
+            name=self.identifier,
+            path=("spec", "image", "url"),
+            timeout=ISO_URL_WAIT_TIMEOUT_SECONDS,
         )
 
-        if baremetalhost is not None:
-            iso_url = baremetalhost.get("spec", {}).get("image", {}).get("url", "")
-
-            if iso_url == "":
-                self.logging.info("BMH .spec.image.url is empty")
-                return self.state
-
-            self.logging.info(f"BMH .spec.image.url found {iso_url}")
-            self.bmh_iso_url = iso_url
+        if not iso_url:
+            baremetalhost = self.swarm_agent_config.kube_cache.get_baremetalhost(
+                namespace=self.cluster_agent_config.cluster_identifier, name=self.identifier
+            )
 
-            self.infraenv_id = self.get_infraenv_id_from_url(self.infraenv_iso_url)
+            if baremetalhost is None:
+                self.log_wait("BMH %s/%s not found", self.cluster_agent_config.cluster_identifier, self.identifier)
+            else:
+                self.log_wait("BMH .spec.image.url is empty")
 
-            return next_state
+            return self.state
 
-        self.logging.info(f"BMH {self.cluster_agent_config.cluster_identifier}/{self.identifier} not found")
+        self.logging.info("BMH .spec.image.url found %s", iso_url)
+        self.bmh_iso_url = iso_url
 
-        return self.state
+        return next_state
 
     def set_bmh_provisioning_state(self, provisioning_state):
-        baremetalhost = self.swarm_agent_config.kube_cache.get_baremetalhost(
-            namespace=self.cluster_agent_config.cluster_identifier, name=self.identifier
+        baremetalhost = self.swarm_agent_config.kube_cache.wait_for_field(
+            "baremetalhosts",
+            namespace=self.cluster_agent_config.cluster_identifier,
+            name=self.identifier,
+            path=(),
+            timeout=BMH_WAIT_TIMEOUT_SECONDS,
         )
 
-        if baremetalhost is not None:
-            baremetalhost["status"] = {
-                "errorCount": 0,
-                "errorMessage": "",
-                "goodCredentials": {},
-                "hardwareProfile": "",
-                "operationalStatus": "discovered",
-                "poweredOn": True,
-                "provisioning": {"state": provisioning_state, "ID": "", "image": {"url": ""}},
-            }
-
-            response = requests.put(
-                f"{self.k8s_api_server_url}/apis/metal3.io/v1alpha1/namespaces/{self.cluster_agent_config.cluster_identifier}/baremetalhosts/{self.identifier}/status",
-                json=baremetalhost,
-                headers={"Authorization": f"Bearer {self.swarm_agent_config.token}"},
-                verify=str(self.swarm_agent_config.ca_cert_path),
-            )
-            response.raise_for_status()
+        if baremetalhost is None:
+            self.log_wait("BMH %s/%s not found", self.cluster_agent_config.cluster_identifier, self.identifier)
+            return False
 
-            return True
+        written = self.swarm_agent_config.bmh_status_writer.set(
+            namespace=self.cluster_agent_config.cluster_identifier,
+            name=self.identifier,
+            provisioning_state=provisioning_state,
+        ).result(timeout=BMH_STATUS_WRITE_TIMEOUT_SECONDS)
 
-        self.logging.info(f"BMH {self.cluster_agent_config.cluster_identifier}/{self.identifier} not found")
+        if not written:
+            self.log_wait("BMH %s/%s not found", self.cluster_agent_config.cluster_identifier, self.identifier)
 
-        return False
+        return written
 
     def ready_bmh(self, next_state):
         if self.set_bmh_provisioning_state("ready"):
@@ -252,15 +273,10 @@ class Agent(RetryingStateMachine, WithContainerConfigs):
         except waiting.TimeoutExpired:
             return False
 
-    def run_agent(self, next_state):
-        # We place the hosts file under /var/log because it's mounted for the installer
-        with tempfile.NamedTemporaryFile(
-            mode="w", delete=False, dir=Path("/var/log"), prefix="agent_cluster_hosts_"
-        ) as cluster_hosts_file:
-            cluster_hosts_file.write(json.dumps(self.cluster_agent_config.cluster_hosts))
-            cluster_hosts_file_path = cluster_hosts_file.name
-
-        new_agent_params = assisted_swarm.NewAgentParams(
+    @cached_property
+    def new_agent_params(self):
+        # Built once, on the first run, so that retries reuse the same parameters
+        return assisted_swarm.NewAgentParams(
             service_url=self.service_url,
             infra_env_id=self.infraenv_id,
             agent_version=self.swarm_agent_config.agent_image_path,
@@ -273,11 +289,12 @@ class Agent(RetryingStateMachine, WithContainerConfigs):
             dry_fake_reboot_marker_path=str(self.fake_reboot_marker_path),
             dry_forced_hostname=self.cluster_agent_config.machine_hostname,
             # The installer needs to know all the hostnames in the cluster
-            dry_cluster_hosts_path=cluster_hosts_file_path,
+            dry_cluster_hosts_path=self.cluster_agent_config.cluster_hosts_file_path,
             dry_forced_host_ipv4=self.cluster_agent_config.machine_ip,
         )
 
-        response = self.swarm_agent_config.swarm_client.create_new_agent(new_agent_params=new_agent_params)
+    def run_agent(self, next_state):
+        response = self.swarm_agent_config.swarm_client.create_new_agent(new_agent_params=self.new_agent_params)
         try:
             return next_state if self.wait_for_completion(response.id) else self.state
         finally:
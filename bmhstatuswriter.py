@@ -0,0 +1,128 @@
+import copy
+import json
+import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event, Lock
+
+
+class BMHStatusWriter:
+    """
+    Writes BMH provisioning states on behalf of all the agents in the swarm.
+
+    Agents don't write to kube-api themselves, they just declare the provisioning state they
+    want their BMH to have. Desired states are collected and flushed periodically - if a BMH
+    gets a newer desired state before the previous one was flushed, only the newest one is
+    written (last write wins), and everyone who asked for either state is told once the newest
+    one has been written. Flushed writes are performed concurrently over the swarm's shared
+    keep-alive HTTP session, so the TLS handshake is paid once rather than once per write.
+    """
+
+    STATUS_TEMPLATE = {
+        "errorCount": 0,
+        "errorMessage": "",
+        "goodCredentials": {},
+        "hardwareProfile": "",
+        "operationalStatus": "discovered",
+        "poweredOn": True,
+        "provisioning": {"state": None, "ID": "", "image": {"url": ""}},
+    }
+
+    def __init__(
+        self,
+        k8s_api_server_url: str,
+        token: str,
+        http_session: requests.Session,
+        done: Event,
+        flush_interval_seconds: float = 0.05,
+        max_concurrent_writes: int = 10,
+        request_timeout_seconds: float = 30,
+    ):
+        self.k8s_api_server_url = k8s_api_server_url
+        self.token = token
+        self.http_session = http_session
+        self.done = done
+        self.flush_interval_seconds = flush_interval_seconds
+        # A hung request must not hold one of the few writer threads forever
+        self.request_timeout_seconds = request_timeout_seconds
+
+        self.writers = ThreadPoolExecutor(max_workers=max_concurrent_writes)
+
+        # (namespace, name) -> (desired provisioning state, futures waiting for it to be written)
+        self.pending = {}
+        self.pending_lock = Lock()
+
+        # BMHs which already had their entire status written
+        self.status_initialized = set()
+
+    def set(self, namespace, name, provisioning_state) -> Future:
+        """
+        Request the provisioning state of the given BMH to be set. The returned future
+        resolves to True once the state has been written, or to False if the BMH doesn't exist.
+        """
+        future = Future()
+
+        with self.pending_lock:
+            _, futures = self.pending.get((namespace, name), (None, []))
+            futures.append(future)
+            self.pending[(namespace, name)] = (provisioning_state, futures)
+
+        return future
+
+    def write(self, namespace, name, provisioning_state):
+        """
+        Merge-patch only the BMH status. Unlike a PUT, a merge patch needs neither the rest of
+        the object nor its resourceVersion, so it can't conflict with other writers.
+
+        The entire status is only written the first time, after that the rest of the status is
+        already in place and only the provisioning state needs to change.
+        """
+        if (namespace, name) in self.status_initialized:
+            status_patch = {"status": {"provisioning": {"state": provisioning_state}}}
+        else:
+            status = copy.deepcopy(self.STATUS_TEMPLATE)
+            status["provisioning"]["state"] = provisioning_state
+            status_patch = {"status": status}
+
+        response = self.http_session.patch(
+            f"{self.k8s_api_server_url}/apis/metal3.io/v1alpha1/namespaces/{namespace}/baremetalhosts/{name}/status",
+            # Compact encoding, so no bytes are wasted on whitespace
+            data=json.dumps(status_patch, separators=(",", ":")).encode("utf-8"),
+            headers={
+                "Authorization": f"Bearer {self.token}",
+                "Content-Type": "application/merge-patch+json",
+            },
+            # No verify= - the server is verified by the SSL context of the session's kube-api adapter
+            timeout=self.request_timeout_seconds,
+        )
+
+        if response.status_code == requests.codes.not_found:
+            return False
+
+        response.raise_for_status()
+        self.status_initialized.add((namespace, name))
+
+        return True
+
+    def write_pending(self, namespace, name, provisioning_state, futures):
+        try:
+            written = self.write(namespace, name, provisioning_state)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future in futures:
+                future.set_result(written)
+
+    def flush(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+
+        for (namespace, name), (provisioning_state, futures) in pending.items():
+            self.writers.submit(self.write_pending, namespace, name, provisioning_state, futures)
+
+    def run(self):
+        while not self.done.wait(self.flush_interval_seconds):
+            self.flush()
+
+        self.flush()
+        self.writers.shutdown(wait=True)
@@ -10,6 +10,7 @@ from collections import OrderedDict
 
 from agent import ClusterAgentConfig, SwarmAgentConfig, Agent
 from dataclasses import dataclass
+from functools import cached_property
 from logging import Logger
 from statemachine import RetryingStateMachine
 from swarmexecutor import SwarmExecutor
@@ -19,6 +20,8 @@ from withcontainerconfigs import WithContainerConfigs
 from threading import Event
 from typing import Dict
 
+LOG_FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC
+
 
 @dataclass
 class ClusterConfig:
@@ -96,6 +99,8 @@ class Cluster(RetryingStateMachine, WithContainerConfigs):
 
         self.controller_stdout_path = self.cluster_dir / "controller.stdout.logs"
         self.controller_stderr_path = self.cluster_dir / "controller.stderr.logs"
+        self.controller_stdout_fd = None
+        self.controller_stderr_fd = None
 
         self.logging = logging
 
@@ -112,7 +117,7 @@ class Cluster(RetryingStateMachine, WithContainerConfigs):
     def dry_reboot_marker(self, agent_index):
         return Path("/var/log") / f"{self.identifier}-{agent_index}-cluster_fake_reboot_marker"
 
-    @property
+    @cached_property
     def cluster_hosts(self):
         return [
             {
@@ -123,6 +128,16 @@ class Cluster(RetryingStateMachine, WithContainerConfigs):
             for agent_index in range(self.total_agents)
         ]
 
+    @cached_property
+    def cluster_hosts_file_path(self):
+        # Shared by the controller and all the agents of the cluster. We place the hosts file under
+        # /var/log because it's mounted for the installer
+        with tempfile.NamedTemporaryFile(
+            mode="w", delete=False, dir=Path("/var/log"), prefix="cluster_hosts_"
+        ) as cluster_hosts_file:
+            cluster_hosts_file.write(json.dumps(self.cluster_hosts))
+            return cluster_hosts_file.name
+
     @property
     def total_agents(self):
         return self.num_control_plane + self.num_workers
@@ -232,7 +247,7 @@ class Cluster(RetryingStateMachine, WithContainerConfigs):
                     cluster_identifier=self.identifier,
                     cluster_dir=self.cluster_dir,
                     identifier=f"{self.identifier}-{agent_index}",
-                    cluster_hosts=self.cluster_hosts,
+                    cluster_hosts_file_path=self.cluster_hosts_file_path,
                     agent_dir=self.agent_directory(agent_index),
                     fake_reboot_marker_path=self.dry_reboot_marker(agent_index),
                 ),
@@ -258,12 +273,6 @@ class Cluster(RetryingStateMachine, WithContainerConfigs):
         # Arbitrarily choose the first agent's reboot marker path as a signal for the controller that it should start
         fake_reboot_marker_path = self.agents[0].fake_reboot_marker_path
 
-        with tempfile.NamedTemporaryFile(
-            mode="w", delete=False, dir=Path("/var/log/"), prefix="controller_cluster_hosts_"
-        ) as cluster_hosts_file:
-            cluster_hosts_file.write(json.dumps(self.cluster_hosts))
-            cluster_hosts_file_path = cluster_hosts_file.name
-
         controller_environment = {
             "CLUSTER_ID": self.infra_id,
             "DRY_ENABLE": "true",
@@ -274,7 +283,7 @@ class Cluster(RetryingStateMachine, WithContainerConfigs):
             "SKIP_CERT_VERIFICATION": "true",
             "HIGH_AVAILABILITY_MODE": "false",
             "CHECK_CLUSTER_VERSION": "true",
-            "DRY_CLUSTER_HOSTS_PATH": cluster_hosts_file_path,
+            "DRY_CLUSTER_HOSTS_PATH": self.cluster_hosts_file_path,
         }
 
         controller_mounts = {str(fake_reboot_marker_path.parent): str(fake_reboot_marker_path.parent)}
@@ -291,23 +300,35 @@ class Cluster(RetryingStateMachine, WithContainerConfigs):
             self.cluster_config.controller_image_path,
         ]
 
-        with self.controller_stdout_path.open("ab") as controller_stdout_file:
-            with self.controller_stderr_path.open("ab") as controller_stderr_file:
-                controller_stdout_file.write(
-                    f"Running controller with command: {podman_command} and env {podman_environment}".encode("utf-8")
-                )
-                controller_process = self.cluster_config.executor.Popen(
-                    self.cluster_config.executor.prepare_sudo_command(podman_command, podman_environment),
-                    env={**os.environ, **podman_environment},
-                    stdin=subprocess.DEVNULL,
-                    stdout=controller_stdout_file,
-                    stderr=controller_stderr_file,
-                )
+        # Opened on the first run and kept open across retries, so the header is only written once. These are
+        # unbuffered file descriptors, so the header is guaranteed to be written before anything the controller writes
+        if self.controller_stdout_fd is None:
+            self.controller_stdout_fd = os.open(self.controller_stdout_path, LOG_FILE_FLAGS, 0o644)
+            os.write(
+                self.controller_stdout_fd,
+                f"Running controller with command: {podman_command} and env {podman_environment}".encode("utf-8"),
+            )
+
+        if self.controller_stderr_fd is None:
+            self.controller_stderr_fd = os.open(self.controller_stderr_path, LOG_FILE_FLAGS, 0o644)
+
+        controller_process = self.cluster_config.executor.Popen(
+            self.cluster_config.executor.prepare_sudo_command(podman_command, podman_environment),
+            env={**os.environ, **podman_environment},
+            stdin=subprocess.DEVNULL,
+            stdout=self.controller_stdout_fd,
+            stderr=self.controller_stderr_fd,
+        )
 
         if controller_process.wait() != 0:
             self.logging.error(f"Controller exited with non-zero exit code {controller_process.returncode}")
             return self.state
 
+        # The controller is never run again
+        os.close(self.controller_stdout_fd)
+        os.close(self.controller_stderr_fd)
+        self.controller_stdout_fd = self.controller_stderr_fd = None
+
         return next_state
 
     def wait_for_agents(self, next_state):
@@ -0,0 +1,80 @@
+import logging
+import requests
+from concurrent.futures import Future
+from threading import BoundedSemaphore, Lock
+
+
+class IsoDownloader:
+    """
+    Downloads the ISO of every infraenv once for the entire swarm.
+
+    Downloading only checks that the ISO is available, its content is never transferred. All
+    agents of an infraenv download the same ISO, so only the first agent to ask for it
+    actually downloads it, the rest just wait for that download to complete. A failed download
+    is forgotten, so the next agent that asks for the ISO will try to download it again.
+    """
+
+    def __init__(
+        self,
+        http_session: requests.Session,
+        max_concurrent_downloads: int = 10,
+        request_timeout_seconds: float = 30,
+        wait_timeout_seconds: float = 120,
+    ):
+        self.http_session = http_session
+
+        # A hung download must neither hold a download slot forever nor block all the infraenv's agents
+        # forever - a timed out agent raises and then simply retries through its state machine
+        self.request_timeout_seconds = request_timeout_seconds
+        self.wait_timeout_seconds = wait_timeout_seconds
+
+        # Different infraenvs may still download at the same time, don't let them overwhelm the service
+        self.download_slots = BoundedSemaphore(max_concurrent_downloads)
+
+        # infraenv ID -> future that resolves once that infraenv's ISO has been downloaded
+        self.downloads = {}
+        self.downloads_lock = Lock()
+
+    def download(self, iso_url):
+        # We don't need the ISO itself, just to know that it can be downloaded, so there's no point
+        # in transferring its (huge) body
+        response = self.http_session.head(
+            iso_url, verify=False, allow_redirects=True, timeout=self.request_timeout_seconds
+        )
+
+        if response.status_code in (requests.codes.method_not_allowed, requests.codes.not_implemented):
+            # Fall back to a ranged GET of just the first byte for servers that don't support HEAD. The
+            # response is streamed and never read, in case the server ignores the range
+            with self.http_session.get(
+                iso_url,
+                stream=True,
+                verify=False,
+                headers={"Range": "bytes=0-0"},
+                timeout=self.request_timeout_seconds,
+            ) as response:
+                response.raise_for_status()
+                return
+
+        response.raise_for_status()
+
+    def ensure(self, infraenv_id, iso_url):
+        with self.downloads_lock:
+            downloaded = self.downloads.get(infraenv_id, None)
+            should_download = downloaded is None
+
+            if should_download:
+                downloaded = self.downloads[infraenv_id] = Future()
+
+        if should_download:
+            try:
+                with self.download_slots:
+                    logging.info("Checking availability of infraenv %s ISO at %s", infraenv_id, iso_url)
+                    self.download(iso_url)
+            except Exception as e:
+                with self.downloads_lock:
+                    del self.downloads[infraenv_id]
+                downloaded.set_exception(e)
+            else:
+                downloaded.set_result(None)
+
+        downloaded.result(timeout=self.wait_timeout_seconds)
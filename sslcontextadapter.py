@@ -0,0 +1,36 @@
+import ssl
+from requests.adapters import HTTPAdapter
+
+
+class SSLContextAdapter(HTTPAdapter):
+    """
+    A requests transport adapter that verifies servers using a pre-loaded SSLContext.
+
+    When given a CA bundle path, requests makes urllib3 parse that bundle again for every
+    new connection. Mounting this adapter for a server instead means the bundle is only
+    parsed once, when the SSLContext is created, and requests to that server don't need
+    to pass verify= at all.
+    """
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        # Newer versions of requests (2.32+) pick the pool's SSL context / CA bundle per request,
+        # which would override ours
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        pool_kwargs.pop("ca_certs", None)
+        pool_kwargs.pop("ca_cert_dir", None)
+        pool_kwargs["ssl_context"] = self.ssl_context
+        return host_params, pool_kwargs
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+
+        # The CA is already loaded into the SSL context, don't let urllib3 load it again
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
@@ -1,6 +1,5 @@
 from collections import OrderedDict
 import time
-from itertools import takewhile
 
 
 class RetryingStateMachine:
@@ -28,6 +27,13 @@ class RetryingStateMachine:
         self.name = name
         self.exponential_backoff = 0
 
+        # The recommended next state of every state never changes, so we compute them all once
+        state_names = list(self.states.keys())
+        self.next_states = dict(zip(state_names, state_names[1:] + [None]))
+
+        # The state whose start was last logged, so retries of the same state don't get logged again
+        self.logged_state = None
+
     def start(self):
         while self.state != self.terminal_state:
             state_successful = self.statemachine()
@@ -43,18 +49,15 @@ class RetryingStateMachine:
         self.logging.info(f'Statemachine "{self.name}" complete')
 
     def get_next_state(self):
-        keys_iter = iter(self.states.keys())
-        for _ in takewhile(lambda k: k != self.state, keys_iter):
-            pass
-        try:
-            return next(keys_iter)
-        except StopIteration:
-            return None
+        return self.next_states.get(self.state, None)
 
     def statemachine(self):
         # States typically don't care what's the next state, so we can just recommend the next one in the list
         next_state = self.get_next_state()
-        self.logging.info(f'State machine "{self.name}" running state: "{self.state}"')
+
+        if self.logged_state != self.state:
+            self.logging.info('State machine "%s" running state: "%s"', self.name, self.state)
+            self.logged_state = self.state
 
         try:
             true_next_state = self.states[self.state](next_state)
@@ -11,7 +11,9 @@ import subprocess
 import base64
 import tempfile
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import ssl
 
 from statemachine import RetryingStateMachine
 from swarmexecutor import SwarmExecutor
@@ -22,8 +24,11 @@ from containerconfig import (
     system_container_config,
 )
 from agent import SwarmAgentConfig
+from bmhstatuswriter import BMHStatusWriter
 from cluster import Cluster, ClusterConfig
+from isodownloader import IsoDownloader
 from swarmkubecache import SwarmKubeCache
+from sslcontextadapter import SSLContextAdapter
 from swarm_api import new_swarm_client
 from combined_agent import CombinedAgent
 
@@ -42,6 +47,11 @@ global_swarm_directory = get_user_cache_dir() / "swarm"
 num_locks = 9000
 bad_lock_return_code = 125
 
+# Max number of concurrent requests the swarm makes to each of kube-api (BMH status writes) and the image
+# service (ISO checks). The shared HTTP session's connection pools are sized to match, so every concurrent
+# request gets a keep-alive connection and none are discarded and re-opened
+max_concurrent_http_requests = 10
+
 
 class Swarm(RetryingStateMachine):
     def __init__(self, pull_secret, pull_secret_file, service_url, release_image, ssh_pub_key):
@@ -83,6 +93,8 @@ class Swarm(RetryingStateMachine):
                     "Pre-caching service images": self.precache_service_images,
                     "Retrieving binary": self.retrieve_agent_binary,
                     "Creating CA Cert": self.create_ca_cert,
+                    "Creating HTTP session": self.create_http_session,
+                    "Starting BMH status writer": self.start_bmh_status_writer,
                     "Determining hostname": self.determine_hostname,
                     "Ready to create clusters": self.ready_to_create_clusters,
                 }
@@ -156,6 +168,35 @@ class Swarm(RetryingStateMachine):
 
         return next_state
 
+    def create_http_session(self, next_state):
+        # Shared by the BMH status writer and the ISO downloader, so they reuse keep-alive connections
+        self.http_session = requests.Session()
+        self.http_session.mount("https://", HTTPAdapter(pool_maxsize=max_concurrent_http_requests))
+
+        # Load the kube-api CA cert once, rather than on every connection to kube-api
+        self.ssl_context = ssl.create_default_context(cafile=str(self.ca_cert_path))
+        self.http_session.mount(
+            self.k8s_api_server_url, SSLContextAdapter(self.ssl_context, pool_maxsize=max_concurrent_http_requests)
+        )
+
+        self.iso_downloader = IsoDownloader(self.http_session, max_concurrent_downloads=max_concurrent_http_requests)
+
+        return next_state
+
+    def start_bmh_status_writer(self, next_state):
+        self.bmh_status_writer_done = threading.Event()
+        self.bmh_status_writer = BMHStatusWriter(
+            k8s_api_server_url=self.k8s_api_server_url,
+            token=self.token,
+            http_session=self.http_session,
+            done=self.bmh_status_writer_done,
+            max_concurrent_writes=max_concurrent_http_requests,
+        )
+        self.bmh_status_writer_thread = threading.Thread(target=self.bmh_status_writer.run, args=())
+        self.bmh_status_writer_thread.start()
+
+        return next_state
+
     def ensure_swarm_directory_exists(self, next_state):
         self.swarm_dir.mkdir(parents=True, exist_ok=True)
 
@@ -391,6 +432,8 @@ class Swarm(RetryingStateMachine):
         return next_state
 
     def finalize(self):
+        self.bmh_status_writer_done.set()
+        self.bmh_status_writer_thread.join()
         self.kube_cache_done.set()
         self.kube_cache_thread.join()
         self.combined_agent.stop()
@@ -447,6 +490,8 @@ class Swarm(RetryingStateMachine):
                 kube_cache=self.kube_cache,
                 num_locks=num_locks,
                 swarm_client=self.swarm_client,
+                bmh_status_writer=self.bmh_status_writer,
+                iso_downloader=self.iso_downloader,
             ),
         )
 
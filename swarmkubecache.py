@@ -1,16 +1,26 @@
 import subprocess
 import json
-import time
-from threading import Event
+from threading import Condition, Event, Lock, Thread
 
 
 class SwarmKubeCache:
     """
-    Periodically fetch swarm-related kube-api objects and store them in a cache.
+    Watch swarm-related kube-api objects and store them in a cache.
     This gives swarm agents an in-memory cache of the kube-api objects, to avoid each agent
     blasting the kube-api endpoint with requests (and consuming a lot of memory, CPU, and network
     resources in the process).
+
+    Every API type is kept up to date by a single long-lived watch per type, rather than by
+    periodically re-listing everything. Agents that wait for an object to reach some
+    state block on a condition variable of that particular object, which is only notified when
+    that object changes, so they neither poll the cache nor get woken up by unrelated changes.
     """
+    API_PATHS = {
+        "agentclusterinstalls": "/apis/extensions.hive.openshift.io/v1beta1/agentclusterinstalls",
+        "baremetalhosts": "/apis/metal3.io/v1alpha1/baremetalhosts",
+        "infraenvs": "/apis/agent-install.openshift.io/v1beta1/infraenvs",
+    }
+
     def __init__(self, done: Event):
         self.cache = {
             "agentclusterinstalls": {},
@@ -19,6 +29,12 @@ class SwarmKubeCache:
         }
 
         self.done = done
+        self.watch_processes = {}
+
+        # All the conditions share this lock, it protects the cache itself
+        self.lock = Lock()
+        # (api type, "namespace/name") -> condition notified whenever that object changes
+        self.object_changed = {}
 
     def get_infraenv(self, name, namespace):
         return self.cache["infraenvs"].get(f"{namespace}/{name}", None)
@@ -29,23 +45,129 @@ class SwarmKubeCache:
     def get_baremetalhost(self, name, namespace):
         return self.cache["baremetalhosts"].get(f"{namespace}/{name}", None)
 
-    def cache_api_type(self, api_type):
+    def wait_for_field(self, api_type, namespace, name, path, predicate=bool, timeout=None):
         """
-        Cache all the kube-api objects of a given type.
+        Block until the field at `path` (a sequence of keys) of the given object satisfies
+        `predicate`, then return the field's value. An empty path refers to the object itself.
+        Returns None if the object doesn't exist or the field doesn't satisfy the predicate
+        before the timeout expires.
         """
-        result = json.loads(subprocess.check_output(["oc", "get", api_type, "-A", "-ojson"]).decode("utf-8"))
+        key = f"{namespace}/{name}"
 
-        for api_object in result["items"]:
-            self.cache[api_type][f"{api_object['metadata']['namespace']}/{api_object['metadata']['name']}"] = api_object
+        def get_field():
+            value = self.cache[api_type].get(key, None)
+            for path_key in path:
+                if not isinstance(value, dict):
+                    return None
+                value = value.get(path_key, None)
+            return value
 
-    def monitor(self):
+        with self.lock:
+            changed = self.object_changed.setdefault((api_type, key), Condition(self.lock))
+            changed.wait_for(lambda: self.done.is_set() or predicate(get_field()), timeout=timeout)
+            value = get_field()
+
+        return value if predicate(value) else None
+
+    def update(self, api_type, event):
+        api_object = event["object"]
+        key = f"{api_object['metadata']['namespace']}/{api_object['metadata']['name']}"
+
+        with self.lock:
+            if event["type"] == "DELETED":
+                self.cache[api_type].pop(key, None)
+            else:
+                self.cache[api_type][key] = api_object
+
+            changed = self.object_changed.get((api_type, key), None)
+            if changed is not None:
+                changed.notify_all()
+
+    def replace(self, api_type, api_objects):
+        """
+        Replace all the cached objects of a given type, dropping objects that no longer exist
+        """
+        cache = {
+            f"{api_object['metadata']['namespace']}/{api_object['metadata']['name']}": api_object
+            for api_object in api_objects
+        }
+
+        with self.lock:
+            changed_keys = self.cache[api_type].keys() | cache.keys()
+            self.cache[api_type] = cache
+
+            for key in changed_keys:
+                changed = self.object_changed.get((api_type, key), None)
+                if changed is not None:
+                    changed.notify_all()
+
+    def watch_api_type(self, api_type):
+        """
+        List all the kube-api objects of a given type into the cache, then stream changes to them
+        into the cache until the watch ends.
+
+        The watch resumes from the list's resourceVersion, so no change is missed between the two.
+        When the watch ends (e.g. it expired with 410 Gone) the caller simply calls this again, which
+        re-lists from scratch.
+        """
+        api_path = self.API_PATHS[api_type]
+
+        api_list = json.loads(subprocess.check_output(["oc", "get", "--raw", api_path]).decode("utf-8"))
+        self.replace(api_type, api_list["items"])
+
+        process = subprocess.Popen(
+            ["oc", "get", "--raw", f"{api_path}?watch=1&resourceVersion={api_list['metadata']['resourceVersion']}"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        with self.lock:
+            self.watch_processes[api_type] = process
+
+            # monitor() may have already stopped the watches it knew about
+            if self.done.is_set():
+                process.kill()
+
+        try:
+            # Watch events are newline delimited
+            for line in process.stdout:
+                event = json.loads(line.decode("utf-8"))
+
+                if event.get("type") == "ERROR":
+                    # Most likely our resourceVersion is too old (410 Gone), we have to re-list
+                    return
+
+                if event.get("type") in ("ADDED", "MODIFIED", "DELETED"):
+                    self.update(api_type, event)
+        finally:
+            process.kill()
+            process.wait()
+
+    def watch_api_type_forever(self, api_type):
         while not self.done.is_set():
-            for api_type in self.cache:
-                try:
-                    self.cache_api_type(api_type)
-                except Exception:
-                    # API is imperfect, this is okay, just try again later
-                    pass
+            try:
+                self.watch_api_type(api_type)
+            except Exception:
+                # API is imperfect, this is okay, just try again later
+                pass
+
+            self.done.wait(5)
+
+    def monitor(self):
+        watchers = [Thread(target=self.watch_api_type_forever, args=(api_type,)) for api_type in self.cache]
+
+        for watcher in watchers:
+            watcher.start()
+
+        self.done.wait()
+
+        # Release anyone still waiting on the cache and stop all watches
+        with self.lock:
+            for changed in self.object_changed.values():
+                changed.notify_all()
 
-            time.sleep(5)
+            for process in self.watch_processes.values():
+                process.kill()
 
+        for watcher in watchers:
+            watcher.join()